@@ -4,18 +4,258 @@ Enhanced Google API Comparison Script
 Better organized output with key metrics and side-by-side comparison
 """
 
+import asyncio
+import csv
+import math
+import os
+import numpy as np
 import pandas as pd
-import requests
-import json
+from aiolimiter import AsyncLimiter
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import partial
+from urllib.parse import quote
 import pygeohash as pgh
 import argparse
 
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+try:
+    import httpx
+    import h2  # noqa: F401 - AsyncClient(http2=True) raises ImportError without it
+    HAS_HTTPX = True
+    HTTPClient = httpx.AsyncClient
+    TRANSPORT_ERRORS = (httpx.TransportError,)
+except ImportError:
+    # Fallback (no httpx, or httpx without its http2 extra): blocking requests calls run from a thread pool
+    import requests
+    from requests.adapters import HTTPAdapter
+    HAS_HTTPX = False
+    HTTPClient = requests.Session
+    TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+try:
+    import python_calamine  # noqa: F401 - registers pandas' 'calamine' engine
+    EXCEL_READ_KWARGS = {'engine': 'calamine'}
+except ImportError:
+    # Fallback: let pandas pick the reader for the file type (openpyxl for .xlsx, xlrd for .xls)
+    EXCEL_READ_KWARGS = {}
+
+# Transient failures are retried with exponential backoff (0.3s, 0.6s, 1.2s)
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Responses are reused for pairs whose coordinates match to 5 decimals (~1 m). Entries hold the
+# full encoded responses (needed for the JSONL/Parquet output), so the size bounds the cache's memory
+DEFAULT_CACHE_SIZE = 5_000
+CACHE_COORD_DECIMALS = 5
+# Directions reports quota/transient failures with HTTP 200 and one of the other statuses
+CACHEABLE_DIRECTIONS_STATUSES = {'OK', 'ZERO_RESULTS'}
+
+# The finished CSV is read back in chunks of this many rows to build the Excel workbook
+EXCEL_CHUNK_SIZE = 10_000
+
+# Geohashes are decoded in chunks so the first API calls start before the whole column is decoded
+DECODE_CHUNK_SIZE = 1000
+
+# Fixed output schema: basic info, comparison metrics, side-by-side fields, then the remaining key metrics
+BASIC_COLUMNS = ['pair_index', 'cx_geohash', 'rx_geohash', 'cx_lat', 'cx_lng', 'rx_lat', 'rx_lng']
+COMPARISON_COLUMNS = ['distance_difference_meters', 'duration_difference_seconds', 'response_time_difference_ms', 'faster_api']
+SIDE_BY_SIDE_GROUPS = [
+    # Distance comparison
+    ['directions_distance_text', 'routes_distance_meters', 'directions_distance_meters'],
+    # Duration comparison
+    ['directions_duration_text', 'routes_duration', 'directions_duration_seconds'],
+    # Polyline comparison
+    ['directions_full_routes_0_overview_polyline_points', 'routes_full_routes_0_legs_0_polyline_encodedPolyline'],
+    # Leg distance comparison
+    ['directions_full_routes_0_legs_0_distance_text', 'routes_full_routes_0_legs_0_distanceMeters', 'directions_full_routes_0_legs_0_distance_value'],
+    # Leg duration comparison
+    ['directions_full_routes_0_legs_0_duration_text', 'routes_full_routes_0_legs_0_duration', 'directions_full_routes_0_legs_0_duration_value'],
+]
+SIDE_BY_SIDE_COLUMNS = [col for group in SIDE_BY_SIDE_GROUPS for col in group]
+KEY_METRIC_COLUMNS = [
+    'directions_start_address', 'directions_end_address', 'directions_status', 'directions_has_error',
+    'routes_leg_distance_meters', 'routes_leg_duration', 'routes_has_polyline', 'routes_polyline_type', 'routes_has_error',
+]
+RESULT_COLUMNS = BASIC_COLUMNS + COMPARISON_COLUMNS + SIDE_BY_SIDE_COLUMNS + KEY_METRIC_COLUMNS
+
+# Parquet copy of the results: typed metric columns plus both raw responses as JSON bytes
+PARQUET_SCHEMA = pa.schema(
+    [
+        ('pair_index', pa.int64()),
+        ('cx_geohash', pa.string()),
+        ('rx_geohash', pa.string()),
+        ('cx_lat', pa.float64()),
+        ('cx_lng', pa.float64()),
+        ('rx_lat', pa.float64()),
+        ('rx_lng', pa.float64()),
+        ('distance_difference_meters', pa.float64()),
+        ('duration_difference_seconds', pa.float64()),
+        ('response_time_difference_ms', pa.float64()),
+        ('faster_api', pa.string()),
+        ('directions_distance_text', pa.string()),
+        ('routes_distance_meters', pa.int64()),
+        ('directions_distance_meters', pa.int64()),
+        ('directions_duration_text', pa.string()),
+        ('routes_duration', pa.string()),
+        ('directions_duration_seconds', pa.int64()),
+        ('directions_full_routes_0_overview_polyline_points', pa.string()),
+        ('routes_full_routes_0_legs_0_polyline_encodedPolyline', pa.string()),
+        ('directions_full_routes_0_legs_0_distance_text', pa.string()),
+        ('routes_full_routes_0_legs_0_distanceMeters', pa.int64()),
+        ('directions_full_routes_0_legs_0_distance_value', pa.int64()),
+        ('directions_full_routes_0_legs_0_duration_text', pa.string()),
+        ('routes_full_routes_0_legs_0_duration', pa.string()),
+        ('directions_full_routes_0_legs_0_duration_value', pa.int64()),
+        ('directions_start_address', pa.string()),
+        ('directions_end_address', pa.string()),
+        ('directions_status', pa.string()),
+        ('directions_has_error', pa.bool_()),
+        ('routes_leg_distance_meters', pa.int64()),
+        ('routes_leg_duration', pa.string()),
+        ('routes_has_polyline', pa.bool_()),
+        ('routes_polyline_type', pa.string()),
+        ('routes_has_error', pa.bool_()),
+        ('directions_response', pa.binary()),
+        ('routes_response', pa.binary()),
+    ]
+)
+# Rows are converted to an Arrow RecordBatch and appended to the Parquet file this many at a time
+PARQUET_BATCH_SIZE = 1000
+
+# Raw response fields shown side by side, read straight from the responses (names kept from the old flattened output)
+RESPONSE_FIELD_PATHS = {
+    'directions_full_routes_0_overview_polyline_points': ('directions', ['routes', 0, 'overview_polyline', 'points']),
+    'routes_full_routes_0_legs_0_polyline_encodedPolyline': ('routes', ['routes', 0, 'legs', 0, 'polyline', 'encodedPolyline']),
+    'directions_full_routes_0_legs_0_distance_text': ('directions', ['routes', 0, 'legs', 0, 'distance', 'text']),
+    'routes_full_routes_0_legs_0_distanceMeters': ('routes', ['routes', 0, 'legs', 0, 'distanceMeters']),
+    'directions_full_routes_0_legs_0_distance_value': ('directions', ['routes', 0, 'legs', 0, 'distance', 'value']),
+    'directions_full_routes_0_legs_0_duration_text': ('directions', ['routes', 0, 'legs', 0, 'duration', 'text']),
+    'routes_full_routes_0_legs_0_duration': ('routes', ['routes', 0, 'legs', 0, 'duration']),
+    'directions_full_routes_0_legs_0_duration_value': ('directions', ['routes', 0, 'legs', 0, 'duration', 'value']),
+}
+
+# Request URLs, built once per call with str.format_map instead of re-encoding a params dict
+DIRECTIONS_URL_TEMPLATE = (
+    "https://maps.googleapis.com/maps/api/directions/json"
+    "?key={key}&origin={origin_lat},{origin_lng}&destination={dest_lat},{dest_lng}&language=en-US"
+)
+ROUTES_URL_TEMPLATE = "https://routes.googleapis.com/directions/v2:computeRoutes?key={key}"
+
+# Routes API fields to request - only what extract_key_metrics and RESPONSE_FIELD_PATHS read.
+# Any new Routes field used in the output must be added here too, or it will be missing from the response.
+ROUTES_FIELD_MASK = ','.join([
+    'routes.distanceMeters',
+    'routes.duration',
+    'routes.polyline.encodedPolyline',
+    'routes.legs.distanceMeters',
+    'routes.legs.duration',
+    'routes.legs.polyline.encodedPolyline',
+])
+
+def _routes_payload(origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float) -> bytes:
+    """Encoded Routes API request body for one origin/destination pair"""
+    return orjson.dumps({
+        "origin": {"location": {"latLng": {"latitude": origin_lat, "longitude": origin_lng}}},
+        "destination": {"location": {"latLng": {"latitude": dest_lat, "longitude": dest_lng}}},
+        "languageCode": "en-US"
+    })
+
+# Accepted input column names, in order of preference
+CX_GEOHASH_COLUMNS = ('CX_GH', 'customer_geohash', 'cx_geohash')
+RX_GEOHASH_COLUMNS = ('RX_GH', 'restaurant_geohash', 'rx_geohash')
+
+# Byte value -> 5-bit geohash digit (-1 for bytes outside the base32 alphabet); both cases accepted like pygeohash
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# pygeohash rejects longer geohashes, so the compiled decoder treats them as invalid too
+GEOHASH_MAX_LENGTH = 12
+GEOHASH_LOOKUP = np.full(256, -1, dtype=np.int8)
+for _digit, _char in enumerate(GEOHASH_BASE32):
+    GEOHASH_LOOKUP[ord(_char)] = _digit
+    GEOHASH_LOOKUP[ord(_char.upper())] = _digit
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def nb_vector_decode(chars, lookup):
+        """Decode a (n, width) zero-padded byte matrix of geohashes to cell-centre lat/lng arrays (NaN if invalid)"""
+        n, width = chars.shape
+        lat = np.empty(n)
+        lng = np.empty(n)
+        for i in prange(n):
+            lat_lo, lat_hi = -90.0, 90.0
+            lng_lo, lng_hi = -180.0, 180.0
+            is_lng = True
+            length = 0
+            valid = True
+            for j in range(width):
+                char = chars[i, j]
+                if char == 0:
+                    break
+                digit = lookup[char]
+                if digit < 0:
+                    valid = False
+                    break
+                length += 1
+                for bit in range(4, -1, -1):
+                    if is_lng:
+                        mid = (lng_lo + lng_hi) / 2
+                        if (digit >> bit) & 1:
+                            lng_lo = mid
+                        else:
+                            lng_hi = mid
+                    else:
+                        mid = (lat_lo + lat_hi) / 2
+                        if (digit >> bit) & 1:
+                            lat_lo = mid
+                        else:
+                            lat_hi = mid
+                    is_lng = not is_lng
+            if valid and 0 < length <= GEOHASH_MAX_LENGTH:
+                lat[i] = (lat_lo + lat_hi) / 2
+                lng[i] = (lng_lo + lng_hi) / 2
+            else:
+                lat[i] = np.nan
+                lng[i] = np.nan
+        return lat, lng
+
 class EnhancedAPIComparison:
-    def __init__(self, directions_key: str, routes_key: str):
+    def __init__(self, directions_key: str, routes_key: str, concurrency: int = 10, rate_limit: float = 50,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
         self.directions_key = directions_key
         self.routes_key = routes_key
+        self.concurrency = concurrency
+        # Per-run request constants, so calls don't rebuild them
+        self._directions_key_param = quote(directions_key, safe='')
+        self.routes_url = ROUTES_URL_TEMPLATE.format(key=quote(routes_key, safe=''))
+        self.routes_headers = {
+            'Content-Type': 'application/json',
+            'X-Goog-FieldMask': ROUTES_FIELD_MASK
+        }
+        # Token buckets allowing bursts up to each API's per-second quota; a fractional rate
+        # becomes one request per 1/rate seconds, since the bucket must hold at least one token
+        if rate_limit >= 1:
+            max_rate, time_period = rate_limit, 1.0
+        else:
+            max_rate, time_period = 1, 1 / rate_limit
+        self.directions_limiter = AsyncLimiter(max_rate, time_period)
+        self.routes_limiter = AsyncLimiter(max_rate, time_period)
+        # LRU of (api, rounded coords) -> in-flight task or encoded response, so duplicate pairs share one request
+        self.cache_size = cache_size
+        self._response_cache = OrderedDict()
+        self.cache_hits = 0
         
     def geohash_to_coords(self, geohash: str):
         """Convert geohash to lat/lng"""
@@ -24,167 +264,397 @@ class EnhancedAPIComparison:
         except:
             return None, None
     
-    def call_directions_api(self, origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float):
-        """Call Google Directions API with timing"""
-        url = "https://maps.googleapis.com/maps/api/directions/json"
-        params = {
-            'key': self.directions_key,
-            'origin': f"{origin_lat},{origin_lng}",
-            'destination': f"{dest_lat},{dest_lng}",
-            'language': 'en-US'
-        }
+    def geohash_column(self, df: pd.DataFrame, candidates):
+        """Return the first present geohash column as an array (all empty if none of the names exist)"""
+        column = next((col for col in candidates if col in df.columns), None)
+        if column is None:
+            return np.full(len(df), '', dtype=object)
+        return df[column].to_numpy()
+    
+    def geohashes_to_coords(self, geohashes):
+        """Convert a column of geohashes to lat/lng float arrays in one pass; invalid entries become NaN"""
+        # Non-strings (e.g. NaN from empty cells) become '' and decode as invalid
+        texts = np.asarray([g if isinstance(g, str) else '' for g in geohashes], dtype=str)
+        
+        if HAS_NUMBA:
+            encoded = np.char.encode(texts, 'ascii', errors='replace')
+            chars = encoded.view(np.uint8).reshape(len(encoded), encoded.itemsize)
+            return nb_vector_decode(chars, GEOHASH_LOOKUP)
         
+        # Fallback: decode one at a time with pygeohash
+        lat = np.full(len(texts), np.nan)
+        lng = np.full(len(texts), np.nan)
+        for i, geohash in enumerate(texts):
+            coords = self.geohash_to_coords(geohash)
+            if None not in coords:
+                lat[i], lng[i] = coords
+        return lat, lng
+    
+    def _send_blocking(self, client: HTTPClient, method: str, url: str, **kwargs):
+        """Fallback transport: send with requests and parse a successful body in the worker thread
+        
+        The request is timed before parsing, so the response time matches the httpx path.
+        """
+        start_time = time.time()
+        response = client.request(method, url, timeout=30, **kwargs)
+        response_time = time.time() - start_time
+        data = orjson.loads(response.content) if response.ok else None
+        return response, data, response_time
+    
+    async def _request_json(self, client: HTTPClient, limiter: AsyncLimiter, method: str, url: str, **kwargs):
+        """Send a request on the pooled client, retrying rate-limit/server errors, and return the parsed JSON
+        
+        Every attempt takes its own limiter token, so retries stay within the rate limit. Only the final
+        attempt is timed into '_response_time_ms', so failed attempts and backoff sleeps aren't counted
+        against the API. Failures come back as an 'error' dict.
+        """
         start_time = time.time()
         try:
-            response = requests.get(url, params=params, timeout=30)
-            response_time = time.time() - start_time
-            response.raise_for_status()
-            result = response.json()
-            result['_response_time_ms'] = round(response_time * 1000, 2)
-            return result
+            for attempt in range(MAX_RETRIES + 1):
+                await limiter.acquire()
+                start_time = time.time()
+                try:
+                    if HAS_HTTPX:
+                        response = await client.request(method, url, **kwargs)
+                        response_time = time.time() - start_time
+                        data = None
+                    else:
+                        # requests takes a raw body as data= where httpx uses content=
+                        if 'content' in kwargs:
+                            kwargs['data'] = kwargs.pop('content')
+                        send = partial(self._send_blocking, client, method, url, **kwargs)
+                        response, data, response_time = await asyncio.get_running_loop().run_in_executor(None, send)
+                except TRANSPORT_ERRORS:
+                    if attempt == MAX_RETRIES:
+                        raise
+                    await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt)
+                    continue
+                
+                if response.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                    await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2 ** attempt)
+                    continue
+                response.raise_for_status()
+                # orjson parses the raw UTF-8 bytes directly, skipping the str decode of response.json()
+                result = orjson.loads(response.content) if data is None else data
+                result['_response_time_ms'] = round(response_time * 1000, 2)
+                return result
         except Exception as e:
             response_time = time.time() - start_time
             return {"error": str(e), "_response_time_ms": round(response_time * 1000, 2)}
     
-    def call_routes_api(self, origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float):
+    async def call_directions_api(self, client: HTTPClient, origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float):
+        """Call Google Directions API with timing"""
+        url = DIRECTIONS_URL_TEMPLATE.format_map({
+            'key': self._directions_key_param,
+            'origin_lat': origin_lat,
+            'origin_lng': origin_lng,
+            'dest_lat': dest_lat,
+            'dest_lng': dest_lng,
+        })
+        
+        return await self._request_json(client, self.directions_limiter, 'GET', url)
+    
+    async def call_routes_api(self, client: HTTPClient, origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float):
         """Call Google Routes API with timing"""
-        url = f"https://routes.googleapis.com/directions/v2:computeRoutes?key={self.routes_key}"
-        headers = {
-            'Content-Type': 'application/json',
-            'X-Goog-FieldMask': '*'
-        }
-        payload = {
-            "origin": {
-                "location": {
-                    "latLng": {
-                        "latitude": origin_lat,
-                        "longitude": origin_lng
-                    }
-                }
-            },
-            "destination": {
-                "location": {
-                    "latLng": {
-                        "latitude": dest_lat,
-                        "longitude": dest_lng
-                    }
-                }
-            },
-            "languageCode": "en-US"
-        }
+        payload = _routes_payload(origin_lat, origin_lng, dest_lat, dest_lng)
         
-        start_time = time.time()
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response_time = time.time() - start_time
-            response.raise_for_status()
-            result = response.json()
-            result['_response_time_ms'] = round(response_time * 1000, 2)
+        return await self._request_json(client, self.routes_limiter, 'POST', self.routes_url, headers=self.routes_headers, content=payload)
+    
+    async def _cached_call(self, api_call, client: HTTPClient, origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float):
+        """Call an API once per rounded coordinate pair; duplicate pairs share the in-flight request or the cached response"""
+        key = (api_call.__name__,) + tuple(round(c, CACHE_COORD_DECIMALS) for c in (origin_lat, origin_lng, dest_lat, dest_lng))
+        entry = self._response_cache.get(key)
+        
+        if entry is None:
+            task = asyncio.ensure_future(api_call(client, origin_lat, origin_lng, dest_lat, dest_lng))
+            self._response_cache[key] = task
+            if len(self._response_cache) > self.cache_size:
+                self._response_cache.popitem(last=False)
+            
+            result = await task
+            if self._response_cache.get(key) is task:
+                # Don't keep failures around - the next duplicate pair should try again
+                if 'error' in result or result.get('status', 'OK') not in CACHEABLE_DIRECTIONS_STATUSES:
+                    del self._response_cache[key]
+                else:
+                    # Finished responses are kept encoded, several times smaller than the parsed dict
+                    self._response_cache[key] = orjson.dumps({k: v for k, v in result.items() if k != '_response_time_ms'})
             return result
-        except Exception as e:
-            response_time = time.time() - start_time
-            return {"error": str(e), "_response_time_ms": round(response_time * 1000, 2)}
+        
+        self._response_cache.move_to_end(key)
+        self.cache_hits += 1
+        
+        # A reused response wasn't timed for this pair, so it comes back without a response time
+        if isinstance(entry, bytes):
+            return orjson.loads(entry)
+        result = dict(await entry)
+        result.pop('_response_time_ms', None)
+        return result
     
     def extract_key_metrics(self, directions_resp, routes_resp):
         """Extract key comparable metrics from both APIs"""
         metrics = {}
         
-        # Directions API metrics
+        # Directions API metrics - a successful response always carries these keys,
+        # so index directly and treat any missing step as "no route"
+        try:
+            leg = directions_resp['routes'][0]['legs'][0]
+            distance = leg['distance']
+            duration = leg['duration']
+            metrics['directions_distance_text'] = distance['text']
+            metrics['directions_distance_meters'] = distance['value']
+            metrics['directions_duration_text'] = duration['text']
+            metrics['directions_duration_seconds'] = duration['value']
+            metrics['directions_start_address'] = leg['start_address']
+            metrics['directions_end_address'] = leg['end_address']
+        except (KeyError, IndexError, TypeError):
+            pass
+        
+        metrics['directions_status'] = directions_resp.get('status', 'UNKNOWN')
+        metrics['directions_response_time_ms'] = directions_resp.get('_response_time_ms')
+        metrics['directions_has_error'] = 'error' in directions_resp
+        
+        # Routes API metrics - proto3 JSON omits zero values, so distance/duration
+        # keep their defaults while the route/leg structure is indexed directly
         try:
-            if 'routes' in directions_resp and directions_resp['routes']:
-                route = directions_resp['routes'][0]
-                if 'legs' in route and route['legs']:
-                    leg = route['legs'][0]
-                    metrics['directions_distance_text'] = leg.get('distance', {}).get('text', '')
-                    metrics['directions_distance_meters'] = leg.get('distance', {}).get('value', 0)
-                    metrics['directions_duration_text'] = leg.get('duration', {}).get('text', '')
-                    metrics['directions_duration_seconds'] = leg.get('duration', {}).get('value', 0)
-                    metrics['directions_start_address'] = leg.get('start_address', '')
-                    metrics['directions_end_address'] = leg.get('end_address', '')
+            route = routes_resp['routes'][0]
+            metrics['routes_distance_meters'] = route.get('distanceMeters', 0)
+            metrics['routes_duration'] = route.get('duration', '')
             
-            metrics['directions_status'] = directions_resp.get('status', 'UNKNOWN')
-            metrics['directions_response_time_ms'] = directions_resp.get('_response_time_ms', 0)
-            metrics['directions_has_error'] = 'error' in directions_resp
+            leg = route['legs'][0]
+            metrics['routes_leg_distance_meters'] = leg.get('distanceMeters', 0)
+            metrics['routes_leg_duration'] = leg.get('duration', '')
             
-        except Exception as e:
-            metrics['directions_extraction_error'] = str(e)
+            # Polyline
+            polyline = route.get('polyline')
+            metrics['routes_has_polyline'] = polyline is not None
+            if polyline is not None:
+                metrics['routes_polyline_type'] = 'encoded_polyline' if 'encodedPolyline' in polyline else 'geo_json'
+        except (KeyError, IndexError, TypeError):
+            pass
+        
+        metrics['routes_response_time_ms'] = routes_resp.get('_response_time_ms')
+        metrics['routes_has_error'] = 'error' in routes_resp
         
-        # Routes API metrics
+        # Comparison metrics (only differences in absolute units, no percentages)
         try:
-            if 'routes' in routes_resp and routes_resp['routes']:
-                route = routes_resp['routes'][0]
-                metrics['routes_distance_meters'] = route.get('distanceMeters', 0)
-                metrics['routes_duration'] = route.get('duration', '')
-                
-                if 'legs' in route and route['legs']:
-                    leg = route['legs'][0]
-                    metrics['routes_leg_distance_meters'] = leg.get('distanceMeters', 0)
-                    metrics['routes_leg_duration'] = leg.get('duration', '')
-                    
-                    # Polyline
-                    if 'polyline' in route:
-                        metrics['routes_has_polyline'] = True
-                        metrics['routes_polyline_type'] = 'encoded_polyline' if 'encodedPolyline' in route['polyline'] else 'geo_json'
-                    else:
-                        metrics['routes_has_polyline'] = False
-                        
-            metrics['routes_response_time_ms'] = routes_resp.get('_response_time_ms', 0)
-            metrics['routes_has_error'] = 'error' in routes_resp
+            dir_dist = metrics.get('directions_distance_meters', 0)
+            routes_dist = metrics.get('routes_distance_meters', 0)
+            if dir_dist > 0 and routes_dist > 0:
+                metrics['distance_difference_meters'] = abs(dir_dist - routes_dist)
             
-        except Exception as e:
-            metrics['routes_extraction_error'] = str(e)
-        
-                    # Comparison metrics (only differences in absolute units, no percentages)
-            try:
-                if metrics.get('directions_distance_meters', 0) > 0 and metrics.get('routes_distance_meters', 0) > 0:
-                    dir_dist = metrics['directions_distance_meters']
-                    routes_dist = metrics['routes_distance_meters']
-                    metrics['distance_difference_meters'] = abs(dir_dist - routes_dist)
-                
-                if metrics.get('directions_duration_seconds', 0) > 0 and metrics.get('routes_duration'):
-                    # Convert routes duration (like "123s") to seconds
-                    routes_duration_str = metrics['routes_duration']
-                    if routes_duration_str.endswith('s'):
-                        routes_duration_sec = float(routes_duration_str[:-1])
-                        dir_duration = metrics['directions_duration_seconds']
-                        metrics['duration_difference_seconds'] = abs(dir_duration - routes_duration_sec)
+            # Convert routes duration (like "123s") to seconds
+            dir_duration = metrics.get('directions_duration_seconds', 0)
+            routes_duration_str = metrics.get('routes_duration', '')
+            if dir_duration > 0 and routes_duration_str.endswith('s'):
+                metrics['duration_difference_seconds'] = abs(dir_duration - float(routes_duration_str[:-1]))
+            
+            # Response time comparison
+            dir_time = metrics['directions_response_time_ms']
+            routes_time = metrics['routes_response_time_ms']
+            if dir_time and routes_time:
+                metrics['response_time_difference_ms'] = abs(dir_time - routes_time)
+                metrics['faster_api'] = 'directions' if dir_time < routes_time else 'routes'
                 
-                # Response time comparison
-                dir_time = metrics.get('directions_response_time_ms', 0)
-                routes_time = metrics.get('routes_response_time_ms', 0)
-                if dir_time > 0 and routes_time > 0:
-                    metrics['response_time_difference_ms'] = abs(dir_time - routes_time)
-                    metrics['faster_api'] = 'directions' if dir_time < routes_time else 'routes'
-                    
-            except Exception as e:
-                metrics['comparison_error'] = str(e)
+        except (TypeError, ValueError) as e:
+            metrics['comparison_error'] = str(e)
             
         return metrics
     
-    def flatten_dict(self, d, parent_key='', sep='_'):
-        """Flatten nested dictionary for CSV output"""
-        items = []
-        if isinstance(d, dict):
-            for k, v in d.items():
-                new_key = f"{parent_key}{sep}{k}" if parent_key else k
-                if isinstance(v, dict):
-                    items.extend(self.flatten_dict(v, new_key, sep=sep).items())
-                elif isinstance(v, list):
-                    if v and isinstance(v[0], dict):
-                        for i, item in enumerate(v):
-                            items.extend(self.flatten_dict(item, f"{new_key}{sep}{i}", sep=sep).items())
-                    else:
-                        items.append((new_key, json.dumps(v)))
-                else:
-                    items.append((new_key, v))
-        return dict(items)
+    def response_field(self, response, path):
+        """Follow a path of keys/indexes into a response, returning None if any step is missing"""
+        value = response
+        for step in path:
+            try:
+                value = value[step]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return value
+    
+    async def _process_one(self, client: HTTPClient, index: int, total: int, cx_geohash, rx_geohash, coords):
+        """Call both APIs concurrently for one pre-decoded geohash pair"""
+        print(f"Processing pair {index + 1}/{total}")
+        
+        if not cx_geohash or not rx_geohash:
+            print(f"Warning: Missing geohash data in row {index + 1}")
+            return None
+        
+        cx_lat, cx_lng, rx_lat, rx_lng = coords
+        
+        if np.isnan(coords).any():
+            print(f"Warning: Invalid geohash data in row {index + 1}")
+            return None
+        
+        # Call both APIs at the same time
+        directions_resp, routes_resp = await asyncio.gather(
+            self._cached_call(self.call_directions_api, client, cx_lat, cx_lng, rx_lat, rx_lng),
+            self._cached_call(self.call_routes_api, client, cx_lat, cx_lng, rx_lat, rx_lng),
+        )
+        
+        # Extract key metrics for comparison
+        key_metrics = self.extract_key_metrics(directions_resp, routes_resp)
+        
+        # Fill the fixed schema; the full responses are kept raw rather than flattened
+        result = dict.fromkeys(RESULT_COLUMNS)
+        result.update({
+            'pair_index': index + 1,
+            'cx_geohash': str(cx_geohash),
+            'rx_geohash': str(rx_geohash),
+            'cx_lat': cx_lat,
+            'cx_lng': cx_lng,
+            'rx_lat': rx_lat,
+            'rx_lng': rx_lng,
+        })
+        
+        for key, value in key_metrics.items():
+            if key in result:
+                result[key] = value
+        
+        responses = {'directions': directions_resp, 'routes': routes_resp}
+        for col, (api, path) in RESPONSE_FIELD_PATHS.items():
+            result[col] = self.response_field(responses[api], path)
+        
+        raw_record = {
+            'pair_index': index + 1,
+            'metrics': key_metrics,
+            'directions': directions_resp,
+            'routes': routes_resp,
+        }
+        return result, raw_record
+    
+    async def _produce_pairs(self, queue: asyncio.Queue, cx_geohashes, rx_geohashes, num_workers: int):
+        """Decode geohashes chunk by chunk and feed the pairs to the workers"""
+        # Each chunk decodes while earlier pairs are waiting on the network; a full queue pauses decoding
+        for start in range(0, len(cx_geohashes), DECODE_CHUNK_SIZE):
+            cx_chunk = cx_geohashes[start:start + DECODE_CHUNK_SIZE]
+            rx_chunk = rx_geohashes[start:start + DECODE_CHUNK_SIZE]
+            cx_lat, cx_lng = self.geohashes_to_coords(cx_chunk)
+            rx_lat, rx_lng = self.geohashes_to_coords(rx_chunk)
+            
+            for offset, (cx_geohash, rx_geohash) in enumerate(zip(cx_chunk, rx_chunk)):
+                coords = (float(cx_lat[offset]), float(cx_lng[offset]), float(rx_lat[offset]), float(rx_lng[offset]))
+                await queue.put((start + offset, cx_geohash, rx_geohash, coords))
+        
+        # One sentinel per worker signals the end of input
+        for _ in range(num_workers):
+            await queue.put(None)
+    
+    async def _consume_pairs(self, client: HTTPClient, queue: asyncio.Queue, total: int, on_result):
+        """Process queued pairs until the end-of-input sentinel, handing each finished pair to on_result"""
+        processed = 0
+        while True:
+            item = await queue.get()
+            if item is None:
+                return processed
+            outcome = await self._process_one(client, item[0], total, *item[1:])
+            if outcome is not None:
+                on_result(*outcome)
+                processed += 1
+    
+    @asynccontextmanager
+    async def _http_client(self, max_in_flight: int):
+        """Yield the shared HTTP/2 httpx client, or a pooled requests.Session used from threads if httpx is missing"""
+        if HAS_HTTPX:
+            # Keep-alive pool shared by both hosts; HTTP/2 multiplexes concurrent calls over each connection
+            limits = httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=60)
+            async with httpx.AsyncClient(http2=True, limits=limits, timeout=30) as client:
+                yield client
+        else:
+            # requests releases the GIL while waiting on sockets, so one thread per in-flight request overlaps I/O
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_in_flight))
+            with requests.Session() as client:
+                client.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=max_in_flight))
+                yield client
+    
+    async def _process_pairs_async(self, df: pd.DataFrame, on_result):
+        """Feed pairs through a bounded queue to a fixed pool of workers sharing one HTTP/2 client"""
+        # The number of workers caps in-flight pairs (and therefore API request rate)
+        num_workers = self.concurrency
+        queue = asyncio.Queue(maxsize=num_workers * 2)
+        
+        # Resolve flexible column names once, then work on plain arrays
+        cx_geohashes = self.geohash_column(df, CX_GEOHASH_COLUMNS)
+        rx_geohashes = self.geohash_column(df, RX_GEOHASH_COLUMNS)
+        
+        # Each worker has at most two requests in flight (Directions + Routes)
+        async with self._http_client(num_workers * 2) as client:
+            _, *processed = await asyncio.gather(
+                self._produce_pairs(queue, cx_geohashes, rx_geohashes, num_workers),
+                *(self._consume_pairs(client, queue, len(df), on_result) for _ in range(num_workers)),
+            )
+        
+        return sum(processed)
+    
+    def update_stats(self, stats: dict, values: pd.Series):
+        """Fold a chunk of values into running count/mean/M2/min/max (pairwise update, so std stays exact)"""
+        values = pd.to_numeric(values, errors='coerce').dropna()
+        if values.empty:
+            return
+        
+        count, mean = len(values), values.mean()
+        m2 = ((values - mean) ** 2).sum()
+        if stats['count']:
+            total = stats['count'] + count
+            delta = mean - stats['mean']
+            stats['m2'] += m2 + delta ** 2 * stats['count'] * count / total
+            stats['mean'] += delta * count / total
+            stats['count'] = total
+            stats['min'] = min(stats['min'], values.min())
+            stats['max'] = max(stats['max'], values.max())
+        else:
+            stats.update(count=count, mean=mean, m2=m2, min=values.min(), max=values.max())
+    
+    def write_excel(self, csv_file: str, excel_file: str):
+        """Build the organized Excel workbook from the finished CSV, a chunk at a time; returns comparison stats"""
+        stats = {col: {'count': 0} for col in COMPARISON_COLUMNS}
+        
+        # constant_memory flushes each row to disk once the next one starts, so cells must be written row by row
+        # (DataFrame.to_excel writes column by column and would lose data in this mode)
+        workbook = xlsxwriter.Workbook(excel_file, {'constant_memory': True})
+        try:
+            # Summary sheet with key metrics only
+            summary_sheet = workbook.add_worksheet('Summary')
+            summary_sheet.write_row(0, 0, RESULT_COLUMNS)
+            next_row = 1
+            for chunk in pd.read_csv(csv_file, chunksize=EXCEL_CHUNK_SIZE):
+                # Empty cells stay blank; Excel can't store NaN
+                values = chunk.astype(object).where(chunk.notna(), None)
+                for row in values.itertuples(index=False):
+                    summary_sheet.write_row(next_row, 0, row)
+                    next_row += 1
+                
+                for col in COMPARISON_COLUMNS:
+                    self.update_stats(stats[col], chunk[col])
+            
+            # Comparison stats (only for numeric columns)
+            stats_rows = []
+            for col, col_stats in stats.items():
+                if col_stats['count']:
+                    count = col_stats['count']
+                    stats_rows.append([
+                        col,
+                        float(col_stats['mean']),
+                        float(col_stats['max']),
+                        float(col_stats['min']),
+                        math.sqrt(col_stats['m2'] / (count - 1)) if count > 1 else None,
+                    ])
+            
+            if stats_rows:
+                stats_sheet = workbook.add_worksheet('Statistics')
+                stats_sheet.write_row(0, 0, ['Metric', 'Mean', 'Max', 'Min', 'Std'])
+                for row_num, row in enumerate(stats_rows, start=1):
+                    stats_sheet.write_row(row_num, 0, row)
+        finally:
+            workbook.close()
+        
+        return stats
     
     def process_pairs(self, input_file: str, output_file: str = None):
         """Process geohash pairs and call both APIs"""
         
         # Read input file
         if input_file.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(input_file)
+            df = pd.read_excel(input_file, **EXCEL_READ_KWARGS)
         else:
             df = pd.read_csv(input_file)
         
@@ -193,175 +663,112 @@ class EnhancedAPIComparison:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             output_file = f"enhanced_comparison_{timestamp}.csv"
         
-        results = []
-        
         print(f"Processing {len(df)} geohash pairs...")
         
-        for index, row in df.iterrows():
-            print(f"Processing pair {index + 1}/{len(df)}")
-            
-            # Get geohashes - flexible column names
-            cx_geohash = row.get('CX_GH', row.get('customer_geohash', row.get('cx_geohash', '')))
-            rx_geohash = row.get('RX_GH', row.get('restaurant_geohash', row.get('rx_geohash', '')))
-            
-            if not cx_geohash or not rx_geohash:
-                print(f"Warning: Missing geohash data in row {index + 1}")
-                continue
-            
-            # Convert to coordinates
-            cx_lat, cx_lng = self.geohash_to_coords(cx_geohash)
-            rx_lat, rx_lng = self.geohash_to_coords(rx_geohash)
-            
-            if None in [cx_lat, cx_lng, rx_lat, rx_lng]:
-                print(f"Warning: Invalid geohash data in row {index + 1}")
-                continue
-            
-            # Call APIs
-            directions_resp = self.call_directions_api(cx_lat, cx_lng, rx_lat, rx_lng)
-            routes_resp = self.call_routes_api(cx_lat, cx_lng, rx_lat, rx_lng)
-            
-            # Extract key metrics for comparison
-            key_metrics = self.extract_key_metrics(directions_resp, routes_resp)
-            
-            # Create result row with organized structure
-            result = {
-                # Basic info
-                'pair_index': index + 1,
-                'cx_geohash': cx_geohash,
-                'rx_geohash': rx_geohash,
-                'cx_lat': cx_lat,
-                'cx_lng': cx_lng,
-                'rx_lat': rx_lat,
-                'rx_lng': rx_lng,
-            }
-            
-            # Add key metrics first for easy comparison
-            result.update(key_metrics)
-            
-            # Add full API responses (flattened)
-            directions_flat = self.flatten_dict(directions_resp, 'directions_full')
-            routes_flat = self.flatten_dict(routes_resp, 'routes_full')
+        # Full API responses go to JSON Lines, one pair per line, instead of exploded CSV columns
+        base_name = os.path.splitext(output_file)[0]
+        raw_file = f"{base_name}.jsonl"
+        parquet_file = f"{base_name}.parquet"
+        excel_file = f"{base_name}.xlsx"
+        
+        # Stream each finished pair straight to disk so memory stays flat regardless of input size
+        with open(output_file, 'w', newline='') as csv_f, open(raw_file, 'wb') as raw_f, \
+                pq.ParquetWriter(parquet_file, PARQUET_SCHEMA) as parquet_writer:
+            csv_writer = csv.DictWriter(csv_f, fieldnames=RESULT_COLUMNS)
+            csv_writer.writeheader()
+            pending_rows = []
             
-            result.update(directions_flat)
-            result.update(routes_flat)
+            def write_parquet_batch():
+                parquet_writer.write_batch(pa.RecordBatch.from_pylist(pending_rows, schema=PARQUET_SCHEMA))
+                pending_rows.clear()
             
-            results.append(result)
+            def write_result(result, raw_record):
+                # Encode each response once and reuse the bytes for both the JSONL line and Parquet
+                directions_json = orjson.dumps(raw_record['directions'])
+                routes_json = orjson.dumps(raw_record['routes'])
+                
+                csv_writer.writerow(result)
+                raw_f.write(b''.join((
+                    b'{"pair_index":', str(raw_record['pair_index']).encode(),
+                    b',"metrics":', orjson.dumps(raw_record['metrics']),
+                    b',"directions":', directions_json,
+                    b',"routes":', routes_json,
+                    b'}\n',
+                )))
+                csv_f.flush()
+                raw_f.flush()
+                
+                pending_rows.append({
+                    **result,
+                    'directions_response': directions_json,
+                    'routes_response': routes_json,
+                })
+                if len(pending_rows) >= PARQUET_BATCH_SIZE:
+                    write_parquet_batch()
             
-            # Rate limiting
-            time.sleep(0.1)
+            processed = asyncio.run(self._process_pairs_async(df, write_result))
+            if pending_rows:
+                write_parquet_batch()
         
         # Save results
-        if results:
-            results_df = pd.DataFrame(results)
-            
-            # Remove redundant columns and organize better
-            cols_to_remove = [
-                # Remove duplicate response time columns
-                'directions_full__response_time_ms', 'routes_full__response_time_ms',
-                # Remove percentage columns (keeping only absolute differences)
-                'distance_difference_percent', 'duration_difference_percent',
-                # Remove timestamp as requested
-                'timestamp',
-                # Remove response time columns as requested
-                'directions_response_time_ms', 'routes_response_time_ms'
-            ]
-            
-            # Remove redundant columns
-            for col in cols_to_remove:
-                if col in results_df.columns:
-                    results_df = results_df.drop(columns=[col])
-            
-            # Organize columns for better readability
-            basic_cols = ['pair_index', 'cx_geohash', 'rx_geohash', 'cx_lat', 'cx_lng', 'rx_lat', 'rx_lng']
-            comparison_cols = [col for col in results_df.columns if any(x in col for x in ['distance_difference', 'duration_difference', 'response_time_difference', 'faster_api'])]
-            key_metric_cols = [col for col in results_df.columns if col.startswith(('directions_', 'routes_')) and not col.startswith(('directions_full', 'routes_full')) and col not in basic_cols]
-            
-            # Group related comparison fields side by side
-            side_by_side_groups = [
-                # Distance comparison
-                ['directions_distance_text', 'routes_distance_meters', 'directions_distance_meters'],
-                # Duration comparison  
-                ['directions_duration_text', 'routes_duration', 'directions_duration_seconds'],
-                # Polyline comparison
-                ['directions_full_routes_0_overview_polyline_points', 'routes_full_routes_0_legs_0_polyline_encodedPolyline'],
-                # Leg distance comparison
-                ['directions_full_routes_0_legs_0_distance_text', 'routes_full_routes_0_legs_0_distanceMeters', 'directions_full_routes_0_legs_0_distance_value'],
-                # Leg duration comparison
-                ['directions_full_routes_0_legs_0_duration_text', 'routes_full_routes_0_legs_0_duration', 'directions_full_routes_0_legs_0_duration_value'],
-            ]
-            
-            # Create ordered side-by-side columns
-            side_by_side_cols = []
-            for group in side_by_side_groups:
-                for col in group:
-                    if col in results_df.columns:
-                        side_by_side_cols.append(col)
-            
-            # Remove side-by-side columns from other categories to avoid duplicates
-            key_metric_cols = [col for col in key_metric_cols if col not in side_by_side_cols]
-            full_response_cols = [col for col in results_df.columns if col.startswith(('directions_full', 'routes_full')) and col not in side_by_side_cols]
-            
-            # Reorder columns with side-by-side groupings
-            ordered_cols = basic_cols + comparison_cols + side_by_side_cols + key_metric_cols + full_response_cols
-            available_cols = [col for col in ordered_cols if col in results_df.columns]
-            results_df = results_df.reindex(columns=available_cols)
-            
-            results_df.to_csv(output_file, index=False)
-            
+        if processed:
             # Also create Excel with multiple sheets
-            excel_file = output_file.replace('.csv', '.xlsx')
-            with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-                # Summary sheet with key metrics only  
-                summary_cols = basic_cols + comparison_cols + side_by_side_cols + key_metric_cols
-                available_summary_cols = [col for col in summary_cols if col in results_df.columns]
-                summary_df = results_df[available_summary_cols]
-                summary_df.to_excel(writer, sheet_name='Summary', index=False)
-                
-                # Full data sheet
-                results_df.to_excel(writer, sheet_name='Full_Data', index=False)
-                
-                # Comparison stats (only for numeric columns)
-                stats_data = []
-                for col in comparison_cols:
-                    if col in results_df.columns and pd.api.types.is_numeric_dtype(results_df[col]):
-                        stats_data.append({
-                            'Metric': col,
-                            'Mean': results_df[col].mean(),
-                            'Max': results_df[col].max(),
-                            'Min': results_df[col].min(),
-                            'Std': results_df[col].std()
-                        })
-                
-                if stats_data:
-                    stats_df = pd.DataFrame(stats_data)
-                    stats_df.to_excel(writer, sheet_name='Statistics', index=False)
+            stats = self.write_excel(output_file, excel_file)
             
             print(f"\n✅ Results saved to:")
-            print(f"  📄 CSV (all data): {output_file}")
+            print(f"  📄 CSV (key metrics): {output_file}")
+            print(f"  🗂️  JSONL (full API responses): {raw_file}")
+            print(f"  🧱 Parquet (metrics + raw responses): {parquet_file}")
             print(f"  📊 Excel (organized): {excel_file}")
-            print(f"📈 Processed {len(results)} pairs successfully")
-            print(f"📋 Total columns: {len(results_df.columns)}")
+            print(f"📈 Processed {processed} pairs successfully")
+            print(f"♻️  Reused cached responses for {self.cache_hits} API calls")
+            print(f"📋 Total columns: {len(RESULT_COLUMNS)}")
             
             # Show summary statistics
-            if comparison_cols:
-                print(f"\n🔍 Comparison Summary:")
-                for col in comparison_cols[:5]:  # Show first 5 comparison metrics
-                    if col in results_df.columns and pd.api.types.is_numeric_dtype(results_df[col]) and results_df[col].notna().any():
-                        avg_val = results_df[col].mean()
-                        print(f"  {col}: avg = {avg_val:.2f}")
+            print(f"\n🔍 Comparison Summary:")
+            for col, col_stats in stats.items():
+                if col_stats['count']:
+                    print(f"  {col}: avg = {col_stats['mean']:.2f}")
         else:
+            for path in (output_file, raw_file, parquet_file):
+                os.remove(path)
             print("❌ No valid results to save")
 
+def int_at_least(minimum: int):
+    """argparse type for integers no smaller than minimum"""
+    def parse(value: str) -> int:
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"must be an integer, got {value!r}")
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f"must be at least {minimum}, got {value}")
+        return number
+    return parse
+
+def positive_float(value: str) -> float:
+    """argparse type for rates that must be above 0"""
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a number, got {value!r}")
+    if not number > 0 or math.isinf(number):
+        raise argparse.ArgumentTypeError(f"must be a finite number above 0, got {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description='Enhanced Google APIs Comparison')
     parser.add_argument('--input', '-i', required=True, help='Input CSV/Excel file')
     parser.add_argument('--output', '-o', help='Output CSV file')
     parser.add_argument('--directions-key', required=True, help='Directions API key')
     parser.add_argument('--routes-key', required=True, help='Routes API key')
+    parser.add_argument('--concurrency', '-c', type=int_at_least(1), default=10, help='Max geohash pairs processed concurrently (default: 10)')
+    parser.add_argument('--rate-limit', type=positive_float, default=50, help='Max requests per second to each API (default: 50)')
+    parser.add_argument('--cache-size', type=int_at_least(0), default=DEFAULT_CACHE_SIZE, help=f'Max API responses kept for duplicate pairs, 0 disables (default: {DEFAULT_CACHE_SIZE})')
     
     args = parser.parse_args()
     
-    comparison = EnhancedAPIComparison(args.directions_key, args.routes_key)
+    comparison = EnhancedAPIComparison(args.directions_key, args.routes_key, args.concurrency, args.rate_limit, args.cache_size)
     comparison.process_pairs(args.input, args.output)
 
 if __name__ == "__main__":